@@ -1,126 +1,193 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, current_app, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from whitenoise import WhiteNoise
+import orjson
 import uuid
 import random
-import string
+import secrets
+import base64
 import os
-import json
+from functools import lru_cache
 
 # Get port from environment variable (for Cloud Run)
 PORT = int(os.environ.get('PORT', 5000))
 
-# Database path (configurable for production)
-DATABASE_PATH = os.environ.get('DATABASE_PATH', 'minesweeper.db')
-
 from database import (
     init_db,
     create_game_session,
     get_game_session,
     update_game_session,
+    save_revealed_unless_completed,
+    record_game_win,
+    finish_game_and_issue_key,
     mark_game_completed,
     create_key,
+    get_session_key,
     verify_key,
     revoke_key,
-    get_all_keys,
+    iter_all_keys,
     get_key_stats,
     # Blackjack functions
     create_blackjack_session,
     get_blackjack_session,
     update_blackjack_session,
+    record_blackjack_win,
     get_or_create_blackjack_session_by_ip,
+    get_blackjack_session_state_by_ip,
     get_setting,
-    set_setting
+    set_setting,
+    close_db_connection,
+    batch_writes,
+    # Cell bitmap helpers
+    test_bit,
+    set_bit,
+    clear_bit,
+    count_bits,
+    build_bitmap,
+    bitmap_cells,
+    load_bitmap
 )
 
-app = Flask(__name__, static_folder='static')
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes jsonify() responses with orjson."""
+    
+    def encode(self, obj, default=None, sort_keys=False, indent=None):
+        """
+        Encode obj to JSON bytes. Takes the json.dumps options orjson can
+        honour; passing any other option raises TypeError.
+        """
+        if indent not in (None, 2):
+            raise TypeError('orjson only supports indent=2')
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        # self.default covers the types Flask serializes that orjson doesn't, e.g. Decimal
+        return orjson.dumps(obj, default=default or self.default, option=option)
+    
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj, **kwargs).decode()
+    
+    def response(self, *args, **kwargs):
+        # Same arguments as jsonify(): one value, several values as a list,
+        # or keyword arguments as an object
+        if args and kwargs:
+            raise TypeError('jsonify() takes either args or kwargs, not both')
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or kwargs or None
+        # Pretty-printed in debug mode unless compact says otherwise, as in Flask
+        pretty = self.compact is False or (self.compact is None and current_app.debug)
+        indent = 2 if pretty else None
+        return current_app.response_class(self.encode(obj, indent=indent), mimetype=self.mimetype)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# /static/ is served by WhiteNoise below, so Flask's own static route is disabled
+app = Flask(__name__, static_folder=None)
+app.json = OrjsonProvider(app)
 CORS(app)
 
-@app.after_request
-def add_header(response):
-    response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-    response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
-    return response
-
-# Serve NNUE file with correct MIME type
-@app.route('/static/js/<path:filename>')
-def serve_js_files(filename):
-    """Serve JS files with correct MIME types."""
-    response = send_from_directory('static/js', filename)
-    if filename.endswith('.nnue'):
-        response.headers['Content-Type'] = 'application/octet-stream'
-    elif filename.endswith('.wasm'):
-        response.headers['Content-Type'] = 'application/wasm'
-    return response
+# WhiteNoise answers /static/ requests before they reach Flask, using
+# sendfile and any precompressed .gz/.br copies next to the files.
+# The engine files carry a hash or version in their name, so browsers may
+# cache them as immutable instead of rechecking the 40 MB of wasm and NNUE data
+app.wsgi_app = WhiteNoise(
+    app.wsgi_app,
+    root=STATIC_DIR,
+    prefix='static/',
+    autorefresh=False,
+    immutable_file_test=r'\.(nnue|wasm)$',
+    mimetypes={
+        '.nnue': 'application/octet-stream',
+        '.wasm': 'application/wasm'
+    }
+)
+
+# Close the request's shared database connection when the request ends
+app.teardown_appcontext(close_db_connection)
 
 # Game configuration
 BOARD_SIZE = 25
 TOTAL_MINES = 120
+# Cells that need to be revealed to win
+SAFE_CELLS = BOARD_SIZE * BOARD_SIZE - TOTAL_MINES
+
+# (dx, dy) offsets of the 8 cells surrounding a cell
+NEIGHBORS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
 
 def generate_key(prefix='MINE-'):
     """Generate a key in format PREFIX-XXXX-XXXX-XXXX-XXXX"""
-    segments = []
-    for _ in range(4):
-        segment = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-        segments.append(segment)
-    return prefix + '-'.join(segments)
+    # 10 random bytes encode to exactly 16 base32 characters (A-Z, 2-7)
+    raw = base64.b32encode(secrets.token_bytes(10)).decode('ascii')
+    return f'{prefix}{raw[:4]}-{raw[4:8]}-{raw[8:12]}-{raw[12:]}'
 
 def generate_mines(board_size, total_mines):
     """Generate random mine positions."""
-    positions = set()
-    while len(positions) < total_mines:
-        x = random.randint(0, board_size - 1)
-        y = random.randint(0, board_size - 1)
-        positions.add((x, y))
-    return [[x, y] for x, y in positions]
-
-def count_adjacent_mines(x, y, mines):
-    """Count the number of mines adjacent to a cell."""
-    mines_set = {tuple(m) for m in mines}
-    count = 0
-    for dx in [-1, 0, 1]:
-        for dy in [-1, 0, 1]:
-            if dx == 0 and dy == 0:
-                continue
-            nx, ny = x + dx, y + dy
-            if (nx, ny) in mines_set:
-                count += 1
-    return count
-
-def flood_fill(x, y, mines, revealed, board_size):
+    indexes = random.sample(range(board_size * board_size), total_mines)
+    return [[i % board_size, i // board_size] for i in indexes]
+
+@lru_cache(maxsize=None)
+def neighbor_indexes(board_size):
+    """
+    Build a table giving, for every cell index, the indexes of the cells
+    around it that are inside the board.
+    """
+    table = []
+    for cell in range(board_size * board_size):
+        cx, cy = cell % board_size, cell // board_size
+        table.append(tuple(
+            (cy + dy) * board_size + (cx + dx)
+            for dx, dy in NEIGHBORS
+            if 0 <= cx + dx < board_size and 0 <= cy + dy < board_size
+        ))
+    return tuple(table)
+
+def precompute_adjacency(mines, board_size):
+    """
+    Build the adjacent-mine count for every cell of the board.
+    Returns a bytes object of board_size * board_size counts indexed by y * board_size + x.
+    """
+    neighbors = neighbor_indexes(board_size)
+    adjacency = bytearray(board_size * board_size)
+    for mx, my in mines:
+        for index in neighbors[my * board_size + mx]:
+            adjacency[index] += 1
+    return bytes(adjacency)
+
+def is_on_board(x, y):
+    """Check that x and y are integer coordinates inside the board."""
+    # type() rather than isinstance(): JSON true/false arrive as bool, a subclass of int
+    return (type(x) is int and type(y) is int
+            and 0 <= x < BOARD_SIZE and 0 <= y < BOARD_SIZE)
+
+def flood_fill(x, y, mines, adjacency, revealed, board_size):
     """
     Perform flood fill to reveal all connected cells with 0 adjacent mines.
-    Returns list of newly revealed cells with their adjacent mine counts.
+    The starting cell must be a safe cell that is not yet revealed.
+    Sets the bit of every newly revealed cell in the revealed bitmap and
+    returns list of their cell indexes (y * board_size + x).
     """
-    mines_set = {tuple(m) for m in mines}
-    revealed_set = {tuple(r) for r in revealed}
-    to_reveal = []
-    stack = [(x, y)]
-    visited = set()
-    
-    while stack:
-        cx, cy = stack.pop()
-        
-        if (cx, cy) in visited:
-            continue
-        if cx < 0 or cx >= board_size or cy < 0 or cy >= board_size:
-            continue
-        if (cx, cy) in mines_set:
-            continue
-        if (cx, cy) in revealed_set:
-            continue
-            
-        visited.add((cx, cy))
-        adjacent = count_adjacent_mines(cx, cy, mines)
-        to_reveal.append({'x': cx, 'y': cy, 'adjacent': adjacent})
-        revealed_set.add((cx, cy))
-        
+    neighbors = neighbor_indexes(board_size)
+    # The bit tests and sets are written out instead of calling test_bit and
+    # set_bit: this loop runs for every cell a click opens, and the calls
+    # would nearly double its time
+    start = y * board_size + x
+    revealed[start >> 3] |= 1 << (start & 7)
+    
+    # The result list doubles as the BFS queue: iterating a list while
+    # appending to it visits the cells in the order they were queued
+    to_reveal = [start]
+    for cell in to_reveal:
         # If this cell has 0 adjacent mines, continue flood fill
-        if adjacent == 0:
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    if dx == 0 and dy == 0:
-                        continue
-                    stack.append((cx + dx, cy + dy))
+        if adjacency[cell] == 0:
+            for index in neighbors[cell]:
+                # Cells are marked revealed when queued, so each is queued only once
+                if (mines[index >> 3] | revealed[index >> 3]) >> (index & 7) & 1:
+                    continue
+                revealed[index >> 3] |= 1 << (index & 7)
+                to_reveal.append(index)
     
     return to_reveal
 
@@ -154,8 +221,9 @@ def new_game():
     """Create a new game session."""
     session_id = str(uuid.uuid4())
     mines = generate_mines(BOARD_SIZE, TOTAL_MINES)
+    adjacency = precompute_adjacency(mines, BOARD_SIZE)
     
-    create_game_session(session_id, mines)
+    create_game_session(session_id, build_bitmap(mines, BOARD_SIZE), adjacency)
     
     return jsonify({
         'session_id': session_id,
@@ -174,6 +242,9 @@ def click():
     if session_id is None or x is None or y is None:
         return jsonify({'error': 'Missing required parameters'}), 400
     
+    if not is_on_board(x, y):
+        return jsonify({'error': 'Invalid cell'}), 400
+    
     session = get_game_session(session_id)
     if not session:
         return jsonify({'error': 'Invalid session'}), 404
@@ -182,34 +253,49 @@ def click():
         return jsonify({'error': 'Game already completed'}), 400
     
     mines = session['mines']
-    revealed = session['revealed']
+    adjacency = session['adjacency']
+    revealed = load_bitmap(session['revealed'], BOARD_SIZE)
+    index = y * BOARD_SIZE + x
     
     # Check if cell is already revealed
-    if [x, y] in revealed:
+    if test_bit(revealed, index):
         return jsonify({'error': 'Cell already revealed'}), 400
     
     # Check if clicked on a mine
-    if [x, y] in mines:
+    if test_bit(mines, index):
         mark_game_completed(session_id)
         return jsonify({
             'result': 'boom',
-            'mines': mines  # Reveal all mines on game over
+            'mines': bitmap_cells(mines, BOARD_SIZE)  # Reveal all mines on game over
         })
     
-    # Safe cell - perform flood fill
-    newly_revealed = flood_fill(x, y, mines, revealed, BOARD_SIZE)
+    # Safe cell - perform flood fill (marks the new cells in revealed)
+    newly_revealed = flood_fill(x, y, mines, adjacency, revealed, BOARD_SIZE)
     
-    # Update revealed cells in database
-    for cell in newly_revealed:
-        if [cell['x'], cell['y']] not in revealed:
-            revealed.append([cell['x'], cell['y']])
+    # Revealed cells go out as parallel lists of cell indexes and adjacent counts
+    revealed_count = count_bits(revealed)
+    response = {
+        'result': 'safe',
+        'cells': newly_revealed,
+        'adjacent': [adjacency[cell] for cell in newly_revealed],
+        'won': revealed_count >= SAFE_CELLS,
+        'revealed_count': revealed_count,
+        'required_count': SAFE_CELLS
+    }
+    
+    if response['won']:
+        # Save the board, end the game and issue the key in one transaction
+        key = generate_key(prefix='MINE-')
+        if not record_game_win(session_id, revealed, key, request.remote_addr):
+            return jsonify({'error': 'Game already completed'}), 400
+        response['key'] = key
+        return jsonify(response)
     
-    update_game_session(session_id, revealed, session['flagged'])
+    # Update revealed cells in database
+    if not save_revealed_unless_completed(session_id, revealed):
+        return jsonify({'error': 'Game already completed'}), 400
     
-    return jsonify({
-        'result': 'safe',
-        'revealed': newly_revealed
-    })
+    return jsonify(response)
 
 @app.route('/api/flag', methods=['POST'])
 def flag():
@@ -222,6 +308,9 @@ def flag():
     if session_id is None or x is None or y is None:
         return jsonify({'error': 'Missing required parameters'}), 400
     
+    if not is_on_board(x, y):
+        return jsonify({'error': 'Invalid cell'}), 400
+    
     session = get_game_session(session_id)
     if not session:
         return jsonify({'error': 'Invalid session'}), 404
@@ -229,23 +318,24 @@ def flag():
     if session['completed']:
         return jsonify({'error': 'Game already completed'}), 400
     
-    revealed = session['revealed']
-    flagged = session['flagged']
+    revealed = load_bitmap(session['revealed'], BOARD_SIZE)
+    flagged = load_bitmap(session['flagged'], BOARD_SIZE)
+    index = y * BOARD_SIZE + x
     
     # Can't flag revealed cells
-    if [x, y] in revealed:
+    if test_bit(revealed, index):
         return jsonify({'error': 'Cannot flag revealed cell'}), 400
     
     # Toggle flag
     is_flagged = False
-    if [x, y] in flagged:
-        flagged.remove([x, y])
+    if test_bit(flagged, index):
+        clear_bit(flagged, index)
         is_flagged = False
     else:
-        flagged.append([x, y])
+        set_bit(flagged, index)
         is_flagged = True
     
-    update_game_session(session_id, revealed, flagged)
+    update_game_session(session_id, flagged=flagged)
     
     return jsonify({
         'success': True,
@@ -264,21 +354,22 @@ def check_win():
     if not session:
         return jsonify({'error': 'Invalid session'}), 404
     
-    mines = session['mines']
-    revealed = session['revealed']
-    
-    # Total cells minus mines = cells that need to be revealed to win
-    total_cells = BOARD_SIZE * BOARD_SIZE
-    safe_cells = total_cells - TOTAL_MINES
-    
-    if len(revealed) >= safe_cells:
-        # Player has won!
-        mark_game_completed(session_id)
-        
-        # Generate and save key
-        key = generate_key(prefix='MINE-')
-        ip_address = request.remote_addr
-        create_key(key, session_id, ip_address)
+    revealed_count = count_bits(session['revealed'])
+    
+    if revealed_count >= SAFE_CELLS:
+        # Player has won! The winning click normally issues the key already
+        key = get_session_key(session_id)
+        if key is None:
+            # A game that ended on a mine has no key and never gets one
+            if session['completed']:
+                return jsonify({'error': 'Game already completed'}), 400
+            # Generate a key and save it together with the completed game;
+            # a request that got there first may have issued one already
+            key = finish_game_and_issue_key(
+                session_id, generate_key(prefix='MINE-'), request.remote_addr
+            )
+            if key is None:
+                return jsonify({'error': 'Game already completed'}), 400
         
         return jsonify({
             'won': True,
@@ -287,8 +378,8 @@ def check_win():
     
     return jsonify({
         'won': False,
-        'revealed_count': len(revealed),
-        'required_count': safe_cells
+        'revealed_count': revealed_count,
+        'required_count': SAFE_CELLS
     })
 
 @app.route('/api/verify-key', methods=['GET'])
@@ -323,8 +414,14 @@ def revoke_key_endpoint():
 @app.route('/api/admin/keys', methods=['GET'])
 def get_all_keys_endpoint():
     """Get all keys (admin endpoint)."""
-    keys = get_all_keys()
-    return jsonify({'keys': keys})
+    # Stream the list one key at a time instead of building it in memory
+    def generate():
+        yield b'{"keys":['
+        for i, key in enumerate(iter_all_keys()):
+            yield orjson.dumps(key) if i == 0 else b',' + orjson.dumps(key)
+        yield b']}'
+    
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/admin/stats', methods=['GET'])
 def get_stats_endpoint():
@@ -378,44 +475,61 @@ def flappy_win():
 
 BLACKJACK_TARGET_WINS = 10
 
+# Cards are stored as ints 0-51: rank card % 13 (ace first), suit card // 13
+CARD_RANKS = ('A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K')
+CARD_SUITS = ('♠', '♥', '♦', '♣')
+
+# Card as sent to the client, indexed by card number
+CARD_FACES = tuple(
+    {'suit': suit, 'value': rank, 'isRed': suit in ('♥', '♦')}
+    for suit in CARD_SUITS
+    for rank in CARD_RANKS
+)
+
+# Points per card with aces counted as 11, indexed by card number
+CARD_POINTS = tuple(
+    11 if rank == 0 else min(rank + 1, 10)
+    for _ in CARD_SUITS
+    for rank in range(len(CARD_RANKS))
+)
+
 def create_blackjack_deck():
     """Create and shuffle a standard 52-card deck."""
-    suits = ['♠', '♥', '♦', '♣']
-    values = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
-    deck = []
-    
-    for suit in suits:
-        for value in values:
-            deck.append({
-                'suit': suit,
-                'value': value,
-                'isRed': suit in ['♥', '♦']
-            })
-    
+    deck = list(range(52))
     random.shuffle(deck)
     return deck
 
-def calculate_blackjack_score(hand):
-    """Calculate the score of a blackjack hand."""
-    score = 0
-    aces = 0
-    
-    for card in hand:
-        value = card['value']
-        if value == 'A':
-            aces += 1
-            score += 11
-        elif value in ['K', 'Q', 'J']:
-            score += 10
-        else:
-            score += int(value)
+def card_dicts(hand):
+    """Convert a hand of card numbers to the card objects sent to the client."""
+    return [CARD_FACES[card] for card in hand]
+
+def add_card_to_score(score, soft_aces, card):
+    """
+    Add a card to a running hand score.
+    soft_aces counts aces still counted as 11; returns the new (score, soft_aces).
+    """
+    score += CARD_POINTS[card]
+    if card % 13 == 0:
+        soft_aces += 1
     
-    # Adjust for aces
-    while score > 21 and aces > 0:
+    # Count aces as 1 instead of 11 while the hand is bust
+    while score > 21 and soft_aces > 0:
         score -= 10
-        aces -= 1
+        soft_aces -= 1
     
-    return score
+    return score, soft_aces
+
+def score_hand(hand):
+    """Return the (score, soft_aces) pair of a blackjack hand."""
+    score = 0
+    soft_aces = 0
+    for card in hand:
+        score, soft_aces = add_card_to_score(score, soft_aces, card)
+    return score, soft_aces
+
+def calculate_blackjack_score(hand):
+    """Calculate the score of a blackjack hand."""
+    return score_hand(hand)[0]
 
 @app.route('/api/blackjack/session', methods=['GET'])
 def get_blackjack_session_endpoint():
@@ -430,15 +544,15 @@ def get_blackjack_session_endpoint():
         
         # For dealer, only show second card if game is not in progress
         if session['game_state'] == 'playing':
-            dealer_visible = [session['dealer_hand'][1]] if len(session['dealer_hand']) > 1 else []
+            dealer_visible = card_dicts(session['dealer_hand'][1:2])
             dealer_score = None
         else:
-            dealer_visible = session['dealer_hand']
+            dealer_visible = card_dicts(session['dealer_hand'])
             dealer_score = calculate_blackjack_score(session['dealer_hand'])
         
         return jsonify({
             'session_id': session['session_id'],
-            'player_hand': session['player_hand'],
+            'player_hand': card_dicts(session['player_hand']),
             'dealer_hand': dealer_visible,
             'dealer_hidden': session['game_state'] == 'playing',
             'player_score': player_score,
@@ -458,8 +572,8 @@ def blackjack_deal():
     """Deal a new blackjack hand."""
     ip_address = request.remote_addr
     
-    # Get existing session or create new one
-    session = get_or_create_blackjack_session_by_ip(ip_address)
+    # Get existing session or create new one; the old deck and hands are replaced
+    session = get_blackjack_session_state_by_ip(ip_address)
     
     if session and session['win_streak'] >= BLACKJACK_TARGET_WINS:
         return jsonify({'error': 'Already won! Reset to play again.'}), 400
@@ -486,13 +600,15 @@ def blackjack_deal():
         # Create new session
         session_id = str(uuid.uuid4())
         win_streak = 0
-        create_blackjack_session(session_id, deck, ip_address)
-        update_blackjack_session(
-            session_id,
-            player_hand=player_hand,
-            dealer_hand=dealer_hand,
-            game_state='playing'
-        )
+        with batch_writes() as conn:
+            create_blackjack_session(session_id, deck, ip_address, conn=conn)
+            update_blackjack_session(
+                session_id,
+                player_hand=player_hand,
+                dealer_hand=dealer_hand,
+                game_state='playing',
+                conn=conn
+            )
     
     player_score = calculate_blackjack_score(player_hand)
     dealer_score = calculate_blackjack_score(dealer_hand)
@@ -506,8 +622,8 @@ def blackjack_deal():
         update_blackjack_session(session_id, game_state='push', win_streak=0)
         return jsonify({
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': 0,
@@ -517,14 +633,15 @@ def blackjack_deal():
         })
     elif player_blackjack:
         # Player wins with blackjack
-        new_streak = win_streak + 1
-        new_state = 'won' if new_streak >= BLACKJACK_TARGET_WINS else 'player_blackjack'
-        update_blackjack_session(session_id, game_state=new_state, win_streak=new_streak)
+        result = record_blackjack_win(session_id, 'player_blackjack', BLACKJACK_TARGET_WINS)
+        if result is None:
+            return jsonify({'error': 'Game not in progress'}), 400
+        new_streak, new_state = result
         
         response = {
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': new_streak,
@@ -533,7 +650,8 @@ def blackjack_deal():
             'message': 'BLACKJACK! You win!'
         }
         
-        if new_streak >= BLACKJACK_TARGET_WINS:
+        # Each streak value is returned once, so only one request mints the key
+        if new_streak == BLACKJACK_TARGET_WINS:
             key = generate_key(prefix='BJ-')
             create_key(key, session_id, ip_address)
             response['key'] = key
@@ -545,8 +663,8 @@ def blackjack_deal():
         update_blackjack_session(session_id, game_state='dealer_blackjack', win_streak=0)
         return jsonify({
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': 0,
@@ -558,8 +676,8 @@ def blackjack_deal():
     # Normal game - only show dealer's second card
     return jsonify({
         'session_id': session_id,
-        'player_hand': player_hand,
-        'dealer_hand': [dealer_hand[1]],  # Only show second card
+        'player_hand': card_dicts(player_hand),
+        'dealer_hand': [CARD_FACES[dealer_hand[1]]],  # Only show second card
         'dealer_hidden': True,
         'player_score': player_score,
         'win_streak': win_streak,
@@ -606,8 +724,8 @@ def blackjack_hit():
         dealer_score = calculate_blackjack_score(dealer_hand)
         return jsonify({
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': 0,
@@ -621,57 +739,56 @@ def blackjack_hit():
     
     # If player has 21, auto-stand
     if player_score == 21:
-        return blackjack_stand_internal(session_id)
+        session['deck'] = deck
+        return blackjack_stand_internal(session)
     
     return jsonify({
         'session_id': session_id,
-        'player_hand': player_hand,
-        'dealer_hand': [dealer_hand[1]],  # Still hidden
+        'player_hand': card_dicts(player_hand),
+        'dealer_hand': [CARD_FACES[dealer_hand[1]]],  # Still hidden
         'dealer_hidden': True,
         'player_score': player_score,
         'win_streak': win_streak,
         'game_state': 'playing'
     })
 
-def blackjack_stand_internal(session_id):
-    """Internal function to handle stand logic."""
-    session = get_blackjack_session(session_id)
-    if not session:
-        return jsonify({'error': 'Invalid session'}), 404
-    
+def blackjack_stand_internal(session):
+    """Internal function to handle stand logic for an already loaded session."""
+    session_id = session['session_id']
     deck = session['deck']
     player_hand = session['player_hand']
     dealer_hand = session['dealer_hand']
-    win_streak = session['win_streak']
     ip_address = session['ip_address']
     
     player_score = calculate_blackjack_score(player_hand)
     
-    # Dealer draws until 17 or higher
-    while calculate_blackjack_score(dealer_hand) < 17:
+    # Dealer draws until 17 or higher, keeping a running score
+    dealer_score, dealer_aces = score_hand(dealer_hand)
+    while dealer_score < 17:
         if len(deck) == 0:
             deck = create_blackjack_deck()
-        dealer_hand.append(deck.pop())
-    
-    dealer_score = calculate_blackjack_score(dealer_hand)
+        card = deck.pop()
+        dealer_hand.append(card)
+        dealer_score, dealer_aces = add_card_to_score(dealer_score, dealer_aces, card)
     
     # Determine winner
     if dealer_score > 21:
         # Dealer busts - player wins
-        new_streak = win_streak + 1
-        new_state = 'won' if new_streak >= BLACKJACK_TARGET_WINS else 'dealer_bust'
-        update_blackjack_session(
+        result = record_blackjack_win(
             session_id,
+            'dealer_bust',
+            BLACKJACK_TARGET_WINS,
             deck=deck,
-            dealer_hand=dealer_hand,
-            game_state=new_state,
-            win_streak=new_streak
+            dealer_hand=dealer_hand
         )
+        if result is None:
+            return jsonify({'error': 'Game not in progress'}), 400
+        new_streak, new_state = result
         
         response = {
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': new_streak,
@@ -680,7 +797,8 @@ def blackjack_stand_internal(session_id):
             'message': 'Dealer busts! You win!'
         }
         
-        if new_streak >= BLACKJACK_TARGET_WINS:
+        # Each streak value is returned once, so only one request mints the key
+        if new_streak == BLACKJACK_TARGET_WINS:
             key = generate_key(prefix='BJ-')
             create_key(key, session_id, ip_address)
             response['key'] = key
@@ -690,20 +808,21 @@ def blackjack_stand_internal(session_id):
     
     elif player_score > dealer_score:
         # Player wins
-        new_streak = win_streak + 1
-        new_state = 'won' if new_streak >= BLACKJACK_TARGET_WINS else 'player_win'
-        update_blackjack_session(
+        result = record_blackjack_win(
             session_id,
+            'player_win',
+            BLACKJACK_TARGET_WINS,
             deck=deck,
-            dealer_hand=dealer_hand,
-            game_state=new_state,
-            win_streak=new_streak
+            dealer_hand=dealer_hand
         )
+        if result is None:
+            return jsonify({'error': 'Game not in progress'}), 400
+        new_streak, new_state = result
         
         response = {
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': new_streak,
@@ -712,7 +831,8 @@ def blackjack_stand_internal(session_id):
             'message': 'You win!'
         }
         
-        if new_streak >= BLACKJACK_TARGET_WINS:
+        # Each streak value is returned once, so only one request mints the key
+        if new_streak == BLACKJACK_TARGET_WINS:
             key = generate_key(prefix='BJ-')
             create_key(key, session_id, ip_address)
             response['key'] = key
@@ -731,8 +851,8 @@ def blackjack_stand_internal(session_id):
         )
         return jsonify({
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': 0,
@@ -752,8 +872,8 @@ def blackjack_stand_internal(session_id):
         )
         return jsonify({
             'session_id': session_id,
-            'player_hand': player_hand,
-            'dealer_hand': dealer_hand,
+            'player_hand': card_dicts(player_hand),
+            'dealer_hand': card_dicts(dealer_hand),
             'player_score': player_score,
             'dealer_score': dealer_score,
             'win_streak': 0,
@@ -778,14 +898,14 @@ def blackjack_stand():
     if session['game_state'] != 'playing':
         return jsonify({'error': 'Game not in progress'}), 400
     
-    return blackjack_stand_internal(session_id)
+    return blackjack_stand_internal(session)
 
 @app.route('/api/blackjack/reset', methods=['POST'])
 def blackjack_reset():
     """Reset the blackjack session (win streak to 0)."""
     ip_address = request.remote_addr
     
-    session = get_or_create_blackjack_session_by_ip(ip_address)
+    session = get_blackjack_session_state_by_ip(ip_address)
     
     if session:
         update_blackjack_session(
@@ -807,6 +927,8 @@ def blackjack_reset():
         'game_state': 'no_session'
     })
 
+# Local development server; production serves app:app through gunicorn
+# (see gunicorn.conf.py)
 if __name__ == '__main__':
     # Initialize database on startup
     init_db()
@@ -1,33 +1,313 @@
 import sqlite3
-import json
+import orjson
 import os
+import time
+import queue
+import atexit
 from datetime import datetime
-from contextlib import contextmanager
+from contextlib import closing, contextmanager
+from flask import g, has_app_context
 
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'minesweeper.db')
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Minesweeper sessions are kept in Redis instead of SQLite when REDIS_URL is set
+REDIS_URL = os.environ.get('REDIS_URL')
+GAME_SESSION_TTL = int(os.environ.get('GAME_SESSION_TTL', 3600))
+
+_redis_client = None
+
+# verify_key results are cached per process for up to this many seconds;
+# other gunicorn workers see a revoke at the latest when their entry expires
+KEY_CACHE_TTL = 30
+KEY_CACHE_SIZE = 4096
+
+# key_value -> (expires_at, is_active), oldest entries first
+_key_cache = {}
+
+# get_setting results are cached per process for this many seconds, so a
+# change made through another worker shows up there within that time
+SETTING_CACHE_TTL = 5
+
+# setting key -> (expires_at, value or None if unset); settings are a
+# handful of fixed names, so the cache needs no size limit
+_setting_cache = {}
+
+# Idle connections kept open for reuse, so requests skip opening the file and
+# keep their page cache and compiled statements
+DB_POOL_SIZE = 8
+
+def _connect():
+    """Open a new SQLite connection with the per-connection settings applied."""
+    # Under gevent a request's greenlet may not run on the thread that
+    # opened its connection, so the same-thread check has to be off.
+    # Each connection keeps up to 256 compiled statements, keyed by SQL text.
+    # isolation_level=None leaves single statements in autocommit mode;
+    # multi-statement writes open their own BEGIN IMMEDIATE transaction.
+    # A writer waits up to 5 seconds for another connection's write lock.
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=5,
+        check_same_thread=False,
+        cached_statements=256,
+        isolation_level=None
+    )
     conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+    conn.execute('PRAGMA synchronous=NORMAL')
+    # Up to 64 MiB of page cache, 256 MiB of the file memory-mapped, and
+    # temporary tables and indexes (e.g. for ORDER BY) kept in memory
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+class _ConnectionPool:
+    """
+    Idle SQLite connections kept for reuse.
+    
+    Connections are handed out most recently used first, so under light load
+    the same few connections with warm page caches serve every request and
+    the rest stay idle.
+    """
+    
+    def __init__(self, size):
+        # Only the non-blocking get_nowait/put_nowait are used, so the queue
+        # never waits on its lock whether or not gevent has patched threading
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def acquire(self):
+        """Take an idle connection, or open one if none is free."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _connect()
+    
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full."""
+        # Don't hand a half-finished transaction to the next user
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    def close_all(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+_pool = _ConnectionPool(DB_POOL_SIZE)
+
+# Closing the last connection checkpoints the WAL back into the database file
+atexit.register(_pool.close_all)
+
+class _ConnectionContext:
+    """Context manager returned by get_db_connection."""
+    
+    __slots__ = ('conn', 'owned')
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.owned = False
+    
+    def __enter__(self):
+        if self.conn is None:
+            if has_app_context():
+                conn = g.get('db_conn')
+                if conn is None:
+                    conn = g.db_conn = _pool.acquire()
+                self.conn = conn
+            else:
+                self.conn = _pool.acquire()
+                self.owned = True
+        return self.conn
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owned:
+            _pool.release(self.conn)
+        return False
+
+def get_db_connection(conn=None):
+    """
+    Context manager for database connections.
+    
+    Inside a Flask request one pooled connection is kept on flask.g and
+    shared by every database call of that request; close_db_connection
+    returns it to the pool when the request ends. Outside a request each
+    use takes a connection from the pool and gives it back afterwards.
+    A connection passed in (e.g. from batch_writes) is used as it is.
+    """
+    # A plain class rather than @contextmanager: this runs for every query,
+    # and entering it shouldn't have to create and drive a generator
+    return _ConnectionContext(conn)
+
+@contextmanager
+def batch_writes():
+    """
+    Run several writes in one transaction with a single commit.
+    
+    Pass the yielded connection as conn= to the write functions; they then
+    leave committing to batch_writes. Everything is rolled back if the
+    block raises.
+    
+    Inside a request the yielded connection is also the one every other
+    database call of the request uses, so a write function called without
+    conn= would commit the batch part way through. That raises a
+    RuntimeError here rather than passing silently.
+    """
+    with get_db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        if not conn.in_transaction:
+            raise RuntimeError('batch_writes transaction was committed before the end of the block')
+        conn.commit()
+
+def close_db_connection(exception=None):
+    """Return the connection kept for the current request to the pool."""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        _pool.release(conn)
+
+def get_redis():
+    """
+    Get the shared Redis client used for game sessions.
+    
+    Returns:
+        A redis.Redis client, or None when REDIS_URL is not configured
+    """
+    global _redis_client
+    if REDIS_URL and _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(REDIS_URL)
+    return _redis_client
+
+def _dumps(value):
+    """Encode a value for a JSON TEXT column."""
+    return orjson.dumps(value).decode()
+
+def _loads(text):
+    """Decode a JSON TEXT column."""
+    return orjson.loads(text)
+
+# Mines, revealed and flagged cells are stored as packed bitmaps: cell index
+# i is bit (i & 7) of byte (i >> 3). An empty bitmap means no cells are set.
+
+def test_bit(bitmap, index):
+    """Check whether the bit for a cell index is set."""
+    return bitmap[index >> 3] >> (index & 7) & 1
+
+def set_bit(bitmap, index):
+    """Set the bit for a cell index in a bytearray bitmap."""
+    bitmap[index >> 3] |= 1 << (index & 7)
+
+def clear_bit(bitmap, index):
+    """Clear the bit for a cell index in a bytearray bitmap."""
+    bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+def count_bits(bitmap):
+    """Count the cells set in a bitmap."""
+    return bin(int.from_bytes(bitmap, 'little')).count('1')
+
+def build_bitmap(cells, board_size):
+    """Pack a list of [x, y] cells into a bitmap with one bit per cell."""
+    bitmap = bytearray((board_size * board_size + 7) // 8)
+    for cx, cy in cells:
+        set_bit(bitmap, cy * board_size + cx)
+    return bitmap
+
+def bitmap_cells(bitmap, board_size):
+    """List the [x, y] cells whose bits are set in a bitmap."""
+    return [[i % board_size, i // board_size]
+            for i in range(board_size * board_size)
+            if test_bit(bitmap, i)]
+
+def load_bitmap(data, board_size):
+    """Copy a stored cell bitmap into a full-size bytearray that can be updated."""
+    bitmap = bytearray((board_size * board_size + 7) // 8)
+    bitmap[:len(data)] = data
+    return bitmap
+
+def _game_session_key(session_id):
+    """Redis key holding the hash for a game session."""
+    return f'session:{session_id}'
+
+def _hset_unless_completed(client, key, fields):
+    """
+    Write fields to a game session hash unless the game is completed.
+    
+    The completed flag is read under WATCH, so a write that races with the
+    game ending is retried against the new state instead of landing on a
+    finished game.
+    
+    Returns:
+        True if the fields were written, False if the game was completed
+    """
+    from redis.exceptions import WatchError
+    with client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                if int(pipe.hget(key, 'completed') or 0):
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, GAME_SESSION_TTL)
+                pipe.execute()
+                return True
+            except WatchError:
+                continue
+
+def _game_session_from_row(row):
+    """Build the session dictionary from a SQLite row or a decoded Redis hash."""
+    return {
+        'session_id': row['session_id'],
+        'mines': row['mines'],
+        'adjacency': row['adjacency'],
+        'revealed': row['revealed'],
+        'flagged': row['flagged'],
+        'created_at': row['created_at'],
+        'completed': bool(int(row['completed']))
+    }
 
 def init_db():
     """Initialize the database with required tables."""
-    with get_db_connection() as conn:
+    # A connection of its own rather than a pooled one: gunicorn runs this
+    # in the master, and the forked workers must not inherit an open handle
+    with closing(_connect()) as conn:
         cursor = conn.cursor()
         
+        # WAL lets reads run while another connection writes; the mode is
+        # stored in the database file, so setting it once here is enough.
+        # The settings that only last for one connection are set in _connect
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        # Tables from before the bitmap layout store cells as JSON lists that
+        # can't be converted without the board size. Keep those rows aside in
+        # game_sessions_legacy and start a new table; the rename must not
+        # rewrite the keys table's reference to game_sessions.
+        cursor.execute('PRAGMA table_info(game_sessions)')
+        columns = {row['name'] for row in cursor.fetchall()}
+        if 'mines_json' in columns:
+            cursor.execute('PRAGMA legacy_alter_table=ON')
+            cursor.execute('ALTER TABLE game_sessions RENAME TO game_sessions_legacy')
+            cursor.execute('PRAGMA legacy_alter_table=OFF')
+        
         # Create game_sessions table (for Minesweeper)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS game_sessions (
                 session_id TEXT PRIMARY KEY,
-                mines_json TEXT NOT NULL,
-                revealed_json TEXT DEFAULT '[]',
-                flagged_json TEXT DEFAULT '[]',
+                mines BLOB NOT NULL,
+                adjacency BLOB NOT NULL,
+                revealed BLOB DEFAULT x'',
+                flagged BLOB DEFAULT x'',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 completed BOOLEAN DEFAULT 0
             )
@@ -47,6 +327,16 @@ def init_db():
             )
         ''')
         
+        # Cards used to be stored as {suit, value, isRed} objects and are now
+        # card numbers. Clear hands and decks still in the old format; a hand in
+        # progress goes back to waiting for a deal, the win streak is kept.
+        cursor.execute('''
+            UPDATE blackjack_sessions
+            SET deck_json = '[]', player_hand_json = '[]', dealer_hand_json = '[]',
+                game_state = CASE WHEN game_state = 'playing' THEN 'waiting' ELSE game_state END
+            WHERE deck_json LIKE '[{%' OR player_hand_json LIKE '[{%' OR dealer_hand_json LIKE '[{%'
+        ''')
+        
         # Create keys table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS keys (
@@ -58,6 +348,22 @@ def init_db():
                 FOREIGN KEY (session_id) REFERENCES game_sessions(session_id)
             )
         ''')
+        
+        # Indexes for the lookups that don't go through a primary key: the
+        # latest blackjack session of an IP, the admin key list (newest
+        # first) and the key issued for a game session
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_blackjack_sessions_ip_created
+            ON blackjack_sessions (ip_address, created_at DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_keys_created
+            ON keys (created_at DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_keys_session
+            ON keys (session_id, created_at DESC)
+        ''')
 
         # Create settings table for dynamic configuration
         cursor.execute('''
@@ -68,21 +374,61 @@ def init_db():
         ''')
         
         conn.commit()
+        
+        # Start from an empty WAL rather than replaying the last run's log
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
 
-def create_game_session(session_id, mines_data):
+def warmup(count=DB_POOL_SIZE):
+    """
+    Open pooled connections ahead of the first requests, so no request pays
+    for opening the file and loading the schema.
+    
+    Args:
+        count: Number of connections to have ready in the pool
+    """
+    conns = [_pool.acquire() for _ in range(count)]
+    for conn in conns:
+        # Any query makes the connection read and parse the schema
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    for conn in conns:
+        _pool.release(conn)
+
+def close_pool():
+    """Close the idle pooled connections, e.g. before the process forks."""
+    _pool.close_all()
+
+def create_game_session(session_id, mines, adjacency):
     """
     Create a new game session with mine positions.
     
     Args:
         session_id: Unique identifier for the game session
-        mines_data: List of [x, y] positions for mines
+        mines: Bitmap of the mine cells
+        adjacency: Bytes of adjacent mine counts, one per cell
     """
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            'session_id': session_id,
+            'mines': bytes(mines),
+            'adjacency': adjacency,
+            'revealed': b'',
+            'flagged': b'',
+            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'completed': 0
+        })
+        pipe.expire(key, GAME_SESSION_TTL)
+        pipe.execute()
+        return
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO game_sessions (session_id, mines_json, revealed_json, flagged_json)
-            VALUES (?, ?, '[]', '[]')
-        ''', (session_id, json.dumps(mines_data)))
+            INSERT INTO game_sessions (session_id, mines, adjacency)
+            VALUES (?, ?, ?)
+        ''', (session_id, bytes(mines), adjacency))
         conn.commit()
 
 def get_game_session(session_id):
@@ -95,43 +441,221 @@ def get_game_session(session_id):
     Returns:
         Dictionary with session data or None if not found
     """
+    client = get_redis()
+    if client is not None:
+        fields = client.hgetall(_game_session_key(session_id))
+        # Hashes written before the bitmap layout have no mines field
+        if b'mines' in fields:
+            row = {name.decode(): value for name, value in fields.items()}
+            row['session_id'] = row['session_id'].decode()
+            row['created_at'] = row['created_at'].decode()
+            return _game_session_from_row(row)
+        return None
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT session_id, mines_json, revealed_json, flagged_json, created_at, completed
+            SELECT session_id, mines, adjacency, revealed, flagged, created_at, completed
             FROM game_sessions
             WHERE session_id = ?
         ''', (session_id,))
         row = cursor.fetchone()
         
         if row:
-            return {
-                'session_id': row['session_id'],
-                'mines': json.loads(row['mines_json']),
-                'revealed': json.loads(row['revealed_json']),
-                'flagged': json.loads(row['flagged_json']),
-                'created_at': row['created_at'],
-                'completed': bool(row['completed'])
-            }
+            return _game_session_from_row(row)
         return None
 
-def update_game_session(session_id, revealed, flagged):
+# UPDATE statements for update_game_session, indexed by a bitmask with bit 0
+# set when revealed changes and bit 1 when flagged changes
+_GAME_UPDATE_SQL = (
+    None,
+    'UPDATE game_sessions SET revealed = ? WHERE session_id = ?',
+    'UPDATE game_sessions SET flagged = ? WHERE session_id = ?',
+    'UPDATE game_sessions SET revealed = ?, flagged = ? WHERE session_id = ?'
+)
+
+def update_game_session(session_id, revealed=None, flagged=None, conn=None):
+    """
+    Update the revealed and/or flagged cells for a game session.
+    
+    Args:
+        session_id: The session ID to update
+        revealed: Bitmap of the cells that have been revealed (optional)
+        flagged: Bitmap of the cells that have been flagged (optional)
+        conn: Connection from batch_writes to write in its transaction (optional)
+    """
+    # Only the bitmaps that were passed in are written
+    fields = {}
+    if revealed is not None:
+        fields['revealed'] = bytes(revealed)
+    if flagged is not None:
+        fields['flagged'] = bytes(flagged)
+    if not fields:
+        return
+    
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, GAME_SESSION_TTL)
+        pipe.execute()
+        return
+    
+    mask = (revealed is not None) | (flagged is not None) << 1
+    with get_db_connection(conn) as db:
+        cursor = db.cursor()
+        cursor.execute(_GAME_UPDATE_SQL[mask], (*fields.values(), session_id))
+        if conn is None:
+            db.commit()
+
+def update_game_sessions_many(updates):
+    """
+    Update the revealed and flagged cells of several game sessions at once.
+    
+    Args:
+        updates: Iterable of (session_id, revealed, flagged) tuples
+    """
+    client = get_redis()
+    if client is not None:
+        pipe = client.pipeline(transaction=False)
+        for session_id, revealed, flagged in updates:
+            key = _game_session_key(session_id)
+            pipe.hset(key, mapping={
+                'revealed': bytes(revealed),
+                'flagged': bytes(flagged)
+            })
+            pipe.expire(key, GAME_SESSION_TTL)
+        pipe.execute()
+        return
+    
+    with batch_writes() as conn:
+        conn.executemany('''
+            UPDATE game_sessions
+            SET revealed = ?, flagged = ?
+            WHERE session_id = ?
+        ''', (
+            (bytes(revealed), bytes(flagged), session_id)
+            for session_id, revealed, flagged in updates
+        ))
+
+def save_revealed_unless_completed(session_id, revealed):
     """
-    Update the revealed and flagged cells for a game session.
+    Save the revealed cells of a game that is still in progress.
     
     Args:
         session_id: The session ID to update
-        revealed: List of [x, y] positions that have been revealed
-        flagged: List of [x, y] positions that have been flagged
+        revealed: Bitmap of the cells that have been revealed
+        
+    Returns:
+        True if the cells were saved, False if the session was already
+        completed, in which case it is left unchanged
     """
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        return _hset_unless_completed(client, key, {'revealed': bytes(revealed)})
+    
+    # A single guarded UPDATE; with isolation_level=None it commits on its own
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             UPDATE game_sessions
-            SET revealed_json = ?, flagged_json = ?
+            SET revealed = ?
+            WHERE session_id = ? AND completed = 0
+        ''', (bytes(revealed), session_id))
+        return cursor.rowcount > 0
+
+def record_game_win(session_id, revealed, key_value, ip_address=None):
+    """
+    Save the winning board, mark the game completed and issue its key
+    in a single transaction.
+    
+    Args:
+        session_id: The session ID that was won
+        revealed: Bitmap of the cells that have been revealed
+        key_value: The key to issue for the win
+        ip_address: Optional IP address of the client
+        
+    Returns:
+        True if the key was issued, False if the game was already completed
+    """
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        if not _hset_unless_completed(client, key, {
+            'revealed': bytes(revealed),
+            'completed': 1
+        }):
+            return False
+        create_key(key_value, session_id, ip_address)
+        return True
+    
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            UPDATE game_sessions
+            SET revealed = ?, completed = 1
+            WHERE session_id = ? AND completed = 0
+        ''', (bytes(revealed), session_id))
+        won = cursor.rowcount > 0
+        if won:
+            _insert_key(cursor, key_value, session_id, ip_address)
+        conn.commit()
+    if won:
+        _key_cache.pop(key_value, None)
+    return won
+
+def finish_game_and_issue_key(session_id, key_value, ip_address=None):
+    """
+    Mark a game session as completed and issue its key in a single
+    transaction, unless the game already has a key or has ended.
+    
+    Args:
+        session_id: The session ID to mark as completed
+        key_value: The key to issue for the game
+        ip_address: Optional IP address of the client
+        
+    Returns:
+        The key already issued for the session, else key_value if it was
+        issued now, or None if the game was completed without a key
+    """
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        if not _hset_unless_completed(client, key, {'completed': 1}):
+            # Another request ended the game first
+            return get_session_key(session_id)
+        create_key(key_value, session_id, ip_address)
+        return key_value
+    
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        # Checked under the write lock, so concurrent calls issue one key
+        cursor.execute('''
+            SELECT key_value FROM keys
             WHERE session_id = ?
-        ''', (json.dumps(revealed), json.dumps(flagged), session_id))
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (session_id,))
+        row = cursor.fetchone()
+        if row is not None:
+            conn.commit()
+            return row['key_value']
+        cursor.execute('''
+            UPDATE game_sessions
+            SET completed = 1
+            WHERE session_id = ? AND completed = 0
+        ''', (session_id,))
+        if cursor.rowcount == 0:
+            conn.commit()
+            return None
+        _insert_key(cursor, key_value, session_id, ip_address)
         conn.commit()
+    _key_cache.pop(key_value, None)
+    return key_value
 
 def mark_game_completed(session_id):
     """
@@ -140,6 +664,15 @@ def mark_game_completed(session_id):
     Args:
         session_id: The session ID to mark as completed
     """
+    client = get_redis()
+    if client is not None:
+        key = _game_session_key(session_id)
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, 'completed', 1)
+        pipe.expire(key, GAME_SESSION_TTL)
+        pipe.execute()
+        return
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
@@ -149,7 +682,7 @@ def mark_game_completed(session_id):
         ''', (session_id,))
         conn.commit()
 
-def create_key(key_value, session_id, ip_address=None):
+def create_key(key_value, session_id, ip_address=None, conn=None):
     """
     Create a new key in the database.
     
@@ -157,19 +690,66 @@ def create_key(key_value, session_id, ip_address=None):
         key_value: The key string (format: MINE-XXXX-XXXX-XXXX-XXXX)
         session_id: The game session that generated this key
         ip_address: Optional IP address of the client
+        conn: Connection from batch_writes to write in its transaction (optional)
+    """
+    with get_db_connection(conn) as db:
+        _insert_key(db.cursor(), key_value, session_id, ip_address)
+        if conn is None:
+            db.commit()
+    # The key may have been cached as unknown or revoked
+    _key_cache.pop(key_value, None)
+
+# Shared by every path that issues a key; an existing key is reactivated
+_UPSERT_KEY_SQL = '''
+    INSERT INTO keys (key_value, session_id, ip_address)
+    VALUES (?, ?, ?)
+    ON CONFLICT(key_value) DO UPDATE SET
+    created_at = CURRENT_TIMESTAMP,
+    is_active = 1,
+    session_id = excluded.session_id,
+    ip_address = excluded.ip_address
+'''
+
+def _insert_key(cursor, key_value, session_id, ip_address):
+    """Insert or reactivate a key row; the caller commits."""
+    cursor.execute(_UPSERT_KEY_SQL, (key_value, session_id, ip_address))
+
+def create_key_many(keys):
+    """
+    Create several keys in one transaction.
+    
+    Args:
+        keys: Iterable of (key_value, session_id, ip_address) tuples
+    """
+    keys = list(keys)
+    with batch_writes() as conn:
+        conn.executemany(_UPSERT_KEY_SQL, keys)
+    for key_value, _, _ in keys:
+        _key_cache.pop(key_value, None)
+
+def get_session_key(session_id):
+    """
+    Get the most recent key issued for a session.
+    
+    Args:
+        session_id: The session ID the key was issued for
+        
+    Returns:
+        The key string, or None if no key was issued
     """
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO keys (key_value, session_id, ip_address)
-            VALUES (?, ?, ?)
-            ON CONFLICT(key_value) DO UPDATE SET
-            created_at = CURRENT_TIMESTAMP,
-            is_active = 1,
-            session_id = excluded.session_id,
-            ip_address = excluded.ip_address
-        ''', (key_value, session_id, ip_address))
-        conn.commit()
+            SELECT key_value FROM keys
+            WHERE session_id = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (session_id,))
+        row = cursor.fetchone()
+        
+        if row:
+            return row['key_value']
+        return None
 
 def verify_key(key_value):
     """
@@ -181,16 +761,25 @@ def verify_key(key_value):
     Returns:
         True if key exists and is active, False otherwise
     """
+    now = time.monotonic()
+    cached = _key_cache.get(key_value)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT is_active FROM keys WHERE key_value = ?
         ''', (key_value,))
         row = cursor.fetchone()
-        
-        if row:
-            return bool(row['is_active'])
-        return False
+    
+    is_active = bool(row and row['is_active'])
+    # Re-insert so the dict stays ordered by age, then drop the oldest entry
+    _key_cache.pop(key_value, None)
+    if len(_key_cache) >= KEY_CACHE_SIZE:
+        del _key_cache[next(iter(_key_cache))]
+    _key_cache[key_value] = (now + KEY_CACHE_TTL, is_active)
+    return is_active
 
 def revoke_key(key_value):
     """
@@ -200,22 +789,29 @@ def revoke_key(key_value):
         key_value: The key to revoke
         
     Returns:
-        True if key was found and revoked, False if key not found
+        True if an active key was found and revoked, False if the key was
+        not found or already revoked
     """
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        # Revoking a revoked key matches no row and writes nothing
         cursor.execute('''
-            UPDATE keys SET is_active = 0 WHERE key_value = ?
+            UPDATE keys SET is_active = 0
+            WHERE key_value = ? AND is_active = 1
+            RETURNING key_value
         ''', (key_value,))
+        revoked = len(cursor.fetchall()) > 0
         conn.commit()
-        return cursor.rowcount > 0
+        _key_cache.pop(key_value, None)
+        return revoked
 
-def get_all_keys():
+def iter_all_keys():
     """
-    Get all keys from database.
+    Iterate over all keys in the database, newest first, reading rows from
+    SQLite as they are consumed.
     
-    Returns:
-        List of dictionaries containing key information
+    Yields:
+        Dictionaries containing key information
     """
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -224,16 +820,23 @@ def get_all_keys():
             FROM keys
             ORDER BY created_at DESC
         ''')
-        keys = []
-        for row in cursor.fetchall():
-            keys.append({
+        for row in cursor:
+            yield {
                 'key_value': row['key_value'],
                 'session_id': row['session_id'],
                 'created_at': row['created_at'],
                 'is_active': bool(row['is_active']),
                 'ip_address': row['ip_address']
-            })
-        return keys
+            }
+
+def get_all_keys():
+    """
+    Get all keys from database.
+    
+    Returns:
+        List of dictionaries containing key information
+    """
+    return list(iter_all_keys())
 
 def get_key_stats():
     """
@@ -244,11 +847,14 @@ def get_key_stats():
     """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) as count FROM keys')
-        total = cursor.fetchone()['count']
-        
-        cursor.execute('SELECT COUNT(*) as count FROM keys WHERE is_active = 1')
-        active = cursor.fetchone()['count']
+        # Count both in a single scan of the table
+        cursor.execute('''
+            SELECT COUNT(*) as total, COALESCE(SUM(is_active = 1), 0) as active
+            FROM keys
+        ''')
+        row = cursor.fetchone()
+        total = row['total']
+        active = row['active']
         
         revoked = total - active
         
@@ -260,22 +866,24 @@ def get_key_stats():
 
 # ==================== BLACKJACK FUNCTIONS ====================
 
-def create_blackjack_session(session_id, deck, ip_address=None):
+def create_blackjack_session(session_id, deck, ip_address=None, conn=None):
     """
     Create a new blackjack session.
     
     Args:
         session_id: Unique identifier for the session
-        deck: List of card dictionaries
+        deck: List of card numbers
         ip_address: Client IP address
+        conn: Connection from batch_writes to write in its transaction (optional)
     """
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+    with get_db_connection(conn) as db:
+        cursor = db.cursor()
         cursor.execute('''
             INSERT INTO blackjack_sessions (session_id, deck_json, player_hand_json, dealer_hand_json, win_streak, game_state, ip_address)
             VALUES (?, ?, '[]', '[]', 0, 'waiting', ?)
-        ''', (session_id, json.dumps(deck), ip_address))
-        conn.commit()
+        ''', (session_id, _dumps(deck), ip_address))
+        if conn is None:
+            db.commit()
 
 def get_blackjack_session(session_id):
     """
@@ -299,9 +907,9 @@ def get_blackjack_session(session_id):
         if row:
             return {
                 'session_id': row['session_id'],
-                'deck': json.loads(row['deck_json']),
-                'player_hand': json.loads(row['player_hand_json']),
-                'dealer_hand': json.loads(row['dealer_hand_json']),
+                'deck': _loads(row['deck_json']),
+                'player_hand': _loads(row['player_hand_json']),
+                'dealer_hand': _loads(row['dealer_hand_json']),
                 'win_streak': row['win_streak'],
                 'game_state': row['game_state'],
                 'created_at': row['created_at'],
@@ -309,7 +917,19 @@ def get_blackjack_session(session_id):
             }
         return None
 
-def update_blackjack_session(session_id, deck=None, player_hand=None, dealer_hand=None, win_streak=None, game_state=None):
+# Columns update_blackjack_session can set, in the order of its arguments
+_BLACKJACK_UPDATE_COLUMNS = ('deck_json', 'player_hand_json', 'dealer_hand_json', 'win_streak', 'game_state')
+
+# UPDATE statement for every combination of those columns, indexed by a
+# bitmask with bit i set when column i is updated
+_BLACKJACK_UPDATE_SQL = tuple(
+    'UPDATE blackjack_sessions SET '
+    + ', '.join(f'{column} = ?' for bit, column in enumerate(_BLACKJACK_UPDATE_COLUMNS) if mask >> bit & 1)
+    + ' WHERE session_id = ?'
+    for mask in range(1 << len(_BLACKJACK_UPDATE_COLUMNS))
+)
+
+def update_blackjack_session(session_id, deck=None, player_hand=None, dealer_hand=None, win_streak=None, game_state=None, conn=None):
     """
     Update a blackjack session.
     
@@ -320,35 +940,76 @@ def update_blackjack_session(session_id, deck=None, player_hand=None, dealer_han
         dealer_hand: Updated dealer hand (optional)
         win_streak: Updated win streak (optional)
         game_state: Updated game state (optional)
+        conn: Connection from batch_writes to write in its transaction (optional)
+    """
+    values = (
+        None if deck is None else _dumps(deck),
+        None if player_hand is None else _dumps(player_hand),
+        None if dealer_hand is None else _dumps(dealer_hand),
+        win_streak,
+        game_state
+    )
+    
+    # Bit i of mask is set when column i is being updated
+    mask = 0
+    params = []
+    for bit, value in enumerate(values):
+        if value is not None:
+            mask |= 1 << bit
+            params.append(value)
+    
+    # Nothing to change, so don't touch the database at all
+    if not mask:
+        return
+    
+    params.append(session_id)
+    with get_db_connection(conn) as db:
+        cursor = db.cursor()
+        cursor.execute(_BLACKJACK_UPDATE_SQL[mask], params)
+        if conn is None:
+            db.commit()
+
+def record_blackjack_win(session_id, game_state, target_wins, deck=None, dealer_hand=None):
+    """
+    Count a won hand in one atomic update.
+    
+    Only a hand that is still being played can be won, so concurrent requests
+    for the same hand can't both increment the win streak.
+    
+    Args:
+        session_id: The session ID that won
+        game_state: State to store for the result, e.g. 'player_win'
+        target_wins: Streak at which the state becomes 'won' instead
+        deck: Updated deck (optional)
+        dealer_hand: Updated dealer hand (optional)
+        
+    Returns:
+        Tuple of (win_streak, game_state) after the update, or None if
+        the session has no hand in progress
     """
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE blackjack_sessions
+            SET win_streak = win_streak + 1,
+                game_state = CASE WHEN win_streak + 1 >= ? THEN 'won' ELSE ? END,
+                deck_json = COALESCE(?, deck_json),
+                dealer_hand_json = COALESCE(?, dealer_hand_json)
+            WHERE session_id = ? AND game_state = 'playing'
+            RETURNING win_streak, game_state
+        ''', (
+            target_wins,
+            game_state,
+            None if deck is None else _dumps(deck),
+            None if dealer_hand is None else _dumps(dealer_hand),
+            session_id
+        ))
+        # Fetch all rows so the statement finishes and its write is committed
+        rows = cursor.fetchall()
         
-        # Build dynamic update query
-        updates = []
-        params = []
-        
-        if deck is not None:
-            updates.append('deck_json = ?')
-            params.append(json.dumps(deck))
-        if player_hand is not None:
-            updates.append('player_hand_json = ?')
-            params.append(json.dumps(player_hand))
-        if dealer_hand is not None:
-            updates.append('dealer_hand_json = ?')
-            params.append(json.dumps(dealer_hand))
-        if win_streak is not None:
-            updates.append('win_streak = ?')
-            params.append(win_streak)
-        if game_state is not None:
-            updates.append('game_state = ?')
-            params.append(game_state)
-        
-        if updates:
-            params.append(session_id)
-            query = f"UPDATE blackjack_sessions SET {', '.join(updates)} WHERE session_id = ?"
-            cursor.execute(query, params)
-            conn.commit()
+        if rows:
+            return rows[0]['win_streak'], rows[0]['game_state']
+        return None
 
 def get_or_create_blackjack_session_by_ip(ip_address):
     """
@@ -374,9 +1035,9 @@ def get_or_create_blackjack_session_by_ip(ip_address):
         if row:
             return {
                 'session_id': row['session_id'],
-                'deck': json.loads(row['deck_json']),
-                'player_hand': json.loads(row['player_hand_json']),
-                'dealer_hand': json.loads(row['dealer_hand_json']),
+                'deck': _loads(row['deck_json']),
+                'player_hand': _loads(row['player_hand_json']),
+                'dealer_hand': _loads(row['dealer_hand_json']),
                 'win_streak': row['win_streak'],
                 'game_state': row['game_state'],
                 'created_at': row['created_at'],
@@ -384,6 +1045,36 @@ def get_or_create_blackjack_session_by_ip(ip_address):
             }
         return None
 
+def get_blackjack_session_state_by_ip(ip_address):
+    """
+    Get the session ID, win streak and game state of the latest blackjack
+    session for an IP, without loading the deck and hands.
+    
+    Args:
+        ip_address: Client IP address
+        
+    Returns:
+        Dictionary with session_id, win_streak and game_state, or None
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT session_id, win_streak, game_state
+            FROM blackjack_sessions
+            WHERE ip_address = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (ip_address,))
+        row = cursor.fetchone()
+        
+        if row:
+            return {
+                'session_id': row['session_id'],
+                'win_streak': row['win_streak'],
+                'game_state': row['game_state']
+            }
+        return None
+
 def delete_blackjack_session(session_id):
     """
     Delete a blackjack session.
@@ -397,16 +1088,23 @@ def delete_blackjack_session(session_id):
         conn.commit()
 
 def get_setting(key, default=None):
-    """Get a setting value."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        row = cursor.fetchone()
-        return row['value'] if row else default
+    """Get a setting value, cached for SETTING_CACHE_TTL seconds."""
+    now = time.monotonic()
+    cached = _setting_cache.get(key)
+    if cached is None or cached[0] <= now:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
+            row = cursor.fetchone()
+        cached = _setting_cache[key] = (now + SETTING_CACHE_TTL, row['value'] if row else None)
+    
+    value = cached[1]
+    return value if value is not None else default
 
 def set_setting(key, value):
     """Set a setting value."""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
-        conn.commit()
\ No newline at end of file
+        conn.commit()
+    _setting_cache.pop(key, None)
\ No newline at end of file
@@ -0,0 +1,25 @@
+import os
+
+# Gunicorn configuration (picked up automatically from the working directory)
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# gevent workers keep serving other players while a request waits on the
+# network (slow clients, Redis). sqlite3 calls run in C without yielding,
+# so a query blocks its whole worker until it returns
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = 1000
+timeout = 0
+
+def on_starting(server):
+    """Create the database tables once, before the workers are forked."""
+    from database import init_db, close_pool
+    init_db()
+    # init_db leaves nothing in the pool, but no SQLite connection may be
+    # carried across the fork into the workers
+    close_pool()
+
+def post_fork(server, worker):
+    """Open each worker's pooled connections before it takes requests."""
+    from database import warmup
+    warmup()
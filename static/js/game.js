@@ -419,18 +419,23 @@ async function handleRightClick(x, y) {
  * Handle reveal response from server (flood fill)
  */
 function handleRevealResponse(data) {
-    if (data.revealed && data.revealed.length > 0) {
-        data.revealed.forEach(cellData => {
-            // Server returns {x, y, adjacent} objects
-            const x = cellData.x;
-            const y = cellData.y;
-            const adjacent = cellData.adjacent;
-            revealCell(x, y, adjacent);
+    if (data.cells && data.cells.length > 0) {
+        // Server returns cell indexes (y * BOARD_SIZE + x) with a parallel list of adjacent counts
+        data.cells.forEach((index, i) => {
+            const x = index % BOARD_SIZE;
+            const y = Math.floor(index / BOARD_SIZE);
+            revealCell(x, y, data.adjacent[i]);
         });
     }
     
-    // Check win after each reveal
-    checkWin();
+    // The winning click comes back with the key; ask check-win only if it's missing
+    if (data.won) {
+        if (data.key) {
+            gameOver(true, data.key);
+        } else {
+            checkWin();
+        }
+    }
 }
 
 /**